@@ -0,0 +1,81 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled splitting of A3M sequence rows into chains.
+
+Optional speed-up for convert_between_a3m_json.py and run_mmseqs2.py. When this module is not built,
+convert_between_a3m_json.py falls back to its NumPy splitting and run_mmseqs2.py to its regex splitter.
+Build it next to the scripts with:
+
+	cythonize -3 -i _a3m_fast.pyx
+
+Uppercase letters and gaps (everything below 'a' in ASCII) count toward the chain lengths, lowercase
+insertions do not. Insertions after the last match column belong to the last chain.
+"""
+
+from array import array
+
+
+cdef list _split(str sequence, long long[::1] lengths):
+	cdef Py_ssize_t n = len(sequence)
+	cdef Py_ssize_t n_chains = lengths.shape[0]
+	cdef Py_ssize_t i = 0, j, start = 0, count, k
+	cdef list result = []
+
+	for k in range(n_chains):
+		count = 0
+		while i < n and count < lengths[k]:
+			if sequence[i] < 0x61:
+				count += 1
+			i += 1
+
+		if k == n_chains - 1 and count == lengths[k]:
+			# keep trailing insertions, unless more match columns follow
+			j = i
+			while j < n and sequence[j] >= 0x61:
+				j += 1
+			if j == n:
+				i = n
+
+		result.append(sequence[start:i])
+		start = i
+
+	return result
+
+
+def split_by_chains(str sequence, lengths):
+	"""
+	Split a sequence into chains based on specified lengths.
+
+	Args:
+		sequence (str): The full protein sequence
+		lengths (list): List of integer lengths for each chain
+
+	Returns:
+		list: List of split chain sequences
+	"""
+	return _split(sequence, array('q', lengths))
+
+
+def split_rows(list rows, lengths):
+	"""
+	Split a block of MSA sequence rows into chains.
+
+	Args:
+		rows (list): Sequence rows of the MSA
+		lengths (list): List of integer lengths for each chain
+
+	Returns:
+		list: For each chain, the list of its part of every row
+	"""
+	cdef long long[::1] targets = array('q', lengths)
+	cdef list per_chain = [[] for _ in range(targets.shape[0])]
+	cdef list split_row
+	cdef Py_ssize_t k
+	cdef str row
+
+	for row in rows:
+		split_row = _split(row, targets)
+		for k in range(targets.shape[0]):
+			(<list>per_chain[k]).append(split_row[k])
+
+	return per_chain
@@ -14,13 +14,39 @@ Hebrew University of Jerusalem
 2025
 """
 
+import io
 import os
 import re
+import mmap
 import json
 import argparse
+import itertools
 
+import numpy as np
 from tqdm.utils import disp_len
 
+try:
+	import _a3m_fast
+except ImportError:
+	_a3m_fast = None
+
+# AF3 parses any JSON, so the files are written compact, the same way with or without orjson
+try:
+	import orjson
+	
+	def dumps_json(data):
+		return orjson.dumps(data)
+	
+	def loads_json(raw):
+		return orjson.loads(raw)
+except ImportError:
+	def dumps_json(data):
+		return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()
+	
+	def loads_json(raw):
+		# the standard library does not take memoryviews
+		return json.loads(bytes(raw))
+
 
 ###### A3M TO JSON ######
 
@@ -35,27 +61,42 @@ def split_sequence_by_chains(sequence, lengths):
 	Returns:
 		list: List of split chain sequences
 	"""
-	result = []
-	current_pos = 0
+	# Count uppercase letters and gaps (everything below 'a' in ASCII), lowercase insertions are skipped
+	seq_bytes = np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)
+	match_count = np.cumsum(seq_bytes < 0x61)
 	
-	for target_length in lengths:
-		chain_seq = ""
-		actual_length = 0
-		
-		# Keep adding characters until we reach the target length for this chain
-		while actual_length < target_length and current_pos < len(sequence):
-			char = sequence[current_pos]
-			chain_seq += char
-			
-			# Only count uppercase letters toward the actual length
-			if not char.islower():
-				actual_length += 1
-			
-			current_pos += 1
-		
-		result.append(chain_seq)
+	# The end of each chain is the position where the running count reaches the cumulative chain length
+	bounds = np.cumsum(lengths)
+	ends = np.searchsorted(match_count, bounds) + 1
+	
+	# Insertions after the last match column belong to the last chain
+	if seq_bytes.size and match_count[-1] == bounds[-1]:
+		ends[-1] = len(sequence)
+	
+	starts = np.concatenate(([0], ends[:-1]))
+	
+	return [sequence[start:end] for start, end in zip(starts, ends)]
+
+
+def iter_a3m_lines(input_file):
+	"""
+	Read an A3M file line by line from a read-only memory map, the pages are loaded on demand.
+
+	Args:
+		input_file (str): Path to the A3M file
+
+	Yields:
+		str: Stripped, non-empty lines of the file
+	"""
+	# an empty file cannot be mapped
+	if os.path.getsize(input_file) == 0:
+		raise ValueError(f"A3M file {input_file} is empty")
 	
-	return result
+	with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		for raw_line in iter(mm.readline, b''):
+			line = raw_line.strip()
+			if line:
+				yield line.decode()
 
 
 def get_data_from_a3m(a3m_lines):
@@ -87,33 +128,83 @@ def get_data_from_a3m(a3m_lines):
 	return chains, dummy_chain_names, sequences, header[0], stoch
 
 
-def split_msa_vertically(chains, dummy_chain_names, a3m_lines):
+def split_rows_by_chains(rows, lengths):
+	"""
+	Split a block of MSA sequence rows into chains at once, using a 2D byte matrix.
+
+	Args:
+		rows (list): Sequence rows of the MSA
+		lengths (list): List of integer lengths for each chain
+
+	Returns:
+		list: For each chain, the list of its part of every row
+	"""
+	row_lengths = np.array([len(row) for row in rows])
+	width = max(int(row_lengths.max()), 1)
+	
+	# Pad with a lowercase letter, so the padding never counts toward the chain lengths
+	padded = b''.join(row.encode('ascii').ljust(width, b'a') for row in rows)
+	msa = np.frombuffer(padded, dtype=np.uint8).reshape(-1, width)
+	match_count = np.cumsum(msa < 0x61, axis=1, dtype=np.int32)
+	bounds = np.cumsum(lengths)
+	
+	# End of each chain (rows along the second axis): first position where the count reaches the bound
+	ends = np.stack([(match_count < bound).sum(axis=1) + 1 for bound in bounds])
+	ends = np.minimum(ends, row_lengths)
+	
+	# Insertions after the last match column belong to the last chain
+	ends[-1] = np.where(match_count[:, -1] <= bounds[-1], row_lengths, ends[-1])
+	starts = np.vstack((np.zeros_like(ends[:1]), ends[:-1]))
+	
+	return [[row[start:end] for row, start, end in zip(rows, chain_starts, chain_ends)]
+	        for chain_starts, chain_ends in zip(starts.tolist(), ends.tolist())]
+
+
+def split_msa_vertically(chains, dummy_chain_names, a3m_lines, block_size=8192):
 	"""
 	Split MSA entries vertically based on chain definitions.
 
+	The lines are consumed in blocks, and the sequence rows of a block are split together.
+
 	Args:
 		chains (list): List of chain lengths
 		dummy_chain_names (list): List of chain identifiers
-		a3m_lines (list): Lines from the A3M file (excluding header)
+		a3m_lines (iterable): Lines from the A3M file (excluding header)
+		block_size (int): Number of lines processed at once
 
 	Returns:
-		dict: Dictionary mapping chain names to their MSA entries
+		dict: Dictionary mapping chain names to their MSA, as newline-terminated A3M text
 	"""
-	# Create dictionary for each chain
-	dict_a3m_per_chain = {chain: [] for chain in dummy_chain_names}
+	# One text buffer per chain, with its bound write method to skip the attribute lookups in the loop
+	chain_buffers = [io.StringIO() for _ in dummy_chain_names]
+	writers = [buf.write for buf in chain_buffers]
 	
-	for line in a3m_lines:
-		if line.startswith('>'):
-			# Add the header line to all chains
-			for chain in dummy_chain_names:
-				dict_a3m_per_chain[chain].append(line)
+	# Use the compiled splitting if it was built
+	split_rows_func = split_rows_by_chains if _a3m_fast is None else _a3m_fast.split_rows
+	
+	a3m_lines = iter(a3m_lines)
+	
+	while True:
+		block = list(itertools.islice(a3m_lines, block_size))
+		if not block:
+			break
+		
+		seq_indices = [i for i, line in enumerate(block) if not line.startswith('>')]
+		if seq_indices:
+			split_rows = split_rows_func([block[i].strip() for i in seq_indices], chains)
 		else:
-			# Split the line into corresponding chains
-			split_sequences = split_sequence_by_chains(line.strip(), chains)
-			
-			for i, chain in enumerate(dummy_chain_names):
-				# Add the sequence to the corresponding chain if it's not only gaps
-				dict_a3m_per_chain[chain].append(split_sequences[i])
+			split_rows = [[] for _ in dummy_chain_names]
+		
+		for write, chain_rows in zip(writers, split_rows):
+			# Header lines stay in place, sequence rows are replaced by the chain's part
+			chain_block = list(block)
+			for i, row in zip(seq_indices, chain_rows):
+				chain_block[i] = row
+			write('\n'.join(chain_block))
+			write('\n')
+	
+	# Create dictionary for each chain
+	dict_a3m_per_chain = {chain: buf.getvalue() for chain, buf in zip(dummy_chain_names, chain_buffers)}
 	
 	return dict_a3m_per_chain
 
@@ -150,7 +241,7 @@ def create_local_job(name, sequences, msas, stoch, seeds=[1]):
 				'protein': {
 					"id": [chr(65 + i)],  # Single letter for each chain (A, B, C...)
 					"sequence": seq,
-					"unpairedMsa": ''.join(msas[i]) if i < len(msas) else [],
+					"unpairedMsa": msas[i] if i < len(msas) else [],
 					"pairedMsa": '',
 					"copies": int(stoch[i]) if stoch and i < len(stoch) else 1
 				}
@@ -192,7 +283,7 @@ def write_chainwise_a3m(dict_a3m_per_chain, output_dir='.'):
 		# Write each chain's MSA to a separate file
 		output_file = os.path.join(output_dir, f"{chain}.a3m")
 		with open(output_file, 'w') as f:
-			f.write('\n'.join(msa))
+			f.write(msa)
 		
 		# create full path
 		output_file = os.path.abspath(output_file)
@@ -217,18 +308,16 @@ def process_a3m_file(input_file, output_dir='.', add_path=False, suffix='', serv
 	
 	basename = os.path.basename(os.path.splitext(input_file)[0])
 	
-	# Read the A3M file
-	with open(input_file, 'r') as f:
-		lines = f.readlines()
-	
-	# Strip lines and remove empty lines
-	lines = [line.strip() for line in lines if line.strip()]
+	# Stream the stripped, non-empty lines of the A3M file
+	lines = iter_a3m_lines(input_file)
+	first_lines = list(itertools.islice(lines, 3))
 	
 	# Extract data from the A3M file
-	chains, dummy_chain_names, sequences, header_name, stoch = get_data_from_a3m(lines)
+	chains, dummy_chain_names, sequences, header_name, stoch = get_data_from_a3m(first_lines)
 	
-	# Split MSA entries vertically by chain
-	dict_a3m_per_chain = split_msa_vertically(chains, dummy_chain_names, lines[1:])
+	# Split MSA entries vertically by chain, consuming the rest of the file
+	dict_a3m_per_chain = split_msa_vertically(chains, dummy_chain_names,
+	                                          itertools.chain(first_lines[1:], lines))
 	
 	if add_path:
 		# if we want smaller JSON files, we just write out the MSA-s, and only provide their path
@@ -246,8 +335,8 @@ def process_a3m_file(input_file, output_dir='.', add_path=False, suffix='', serv
 	output_file = os.path.join(output_dir, os.path.basename(output_file))
 	
 	# Write the JSON file
-	with open(output_file, 'w') as f:
-		json.dump(json_data, f, indent=4)
+	with open(output_file, 'wb') as f:
+		f.write(dumps_json(json_data))
 	
 	print(f"Processed {input_file} -> {output_file}")
 
@@ -267,57 +356,79 @@ def get_paired_headers(seqlens, dict_keys):
 	return paired_headers
 
 
+def pair_msa_lines(lines):
+	"""
+	Pair each header line of an MSA with the sequence line following it.
+
+	Args:
+		lines (iterable): Lines of the MSA, lines that are neither a header nor its sequence (e.g. '#' lines) are skipped
+
+	Yields:
+		tuple: (header, sequence) of each record
+	"""
+	lines = iter(lines)
+	for line in lines:
+		if line.startswith('>'):
+			seq = next(lines, None)
+			if seq is None:
+				return
+			yield line, seq
+
+
+def iter_msa_records(unpaired_msa):
+	"""
+	Iterate over the records of an MSA, given inline or as the path of an A3M file.
+
+	Args:
+		unpaired_msa (str): MSA text or path to an A3M file
+
+	Yields:
+		tuple: (header, sequence) of each record
+	"""
+	if '\n' not in unpaired_msa and os.path.isfile(unpaired_msa):
+		if os.path.getsize(unpaired_msa) == 0:
+			return
+
+		# read the non-empty lines from the memory-mapped file
+		with open(unpaired_msa, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+			lines = (raw_line.strip() for raw_line in iter(mm.readline, b''))
+			yield from pair_msa_lines(line.decode() for line in lines if line)
+	else:
+		yield from pair_msa_lines(unpaired_msa.splitlines())
+
+
 def process_chain(json_chain):
-	num_copies = json_chain['protein']['copies'] if 'copies' in json_chain['protein'].keys() else len(json_chain['protein']['id'])
+	num_copies = json_chain['protein']['copies'] if 'copies' in json_chain['protein'] else len(json_chain['protein']['id'])
 	sequence = json_chain['protein']['sequence']
 
 	seqlen = len(sequence)
 
-	# get the MSA
-	unpaired_msa = json_chain['protein']['unpairedMsa'].split('\n')
-	if len(unpaired_msa) == 1:
-		if os.path.isfile(json_chain['protein']['unpairedMsa']):
-			# read without new line
-			with open(json_chain['protein']['unpairedMsa'], 'r') as f:
-				unpaired_msa = f.readlines()
-				unpaired_msa = [line.strip() for line in unpaired_msa[1:] if line.strip()]
-
 	# split into paired and unpaired dictionaries based on 'E+' or 'E-' in header
 	unpaired_dict = {}
 	paired_dict = {}
 
-	for i in range(0, len(unpaired_msa), 2):
-		if i+1 < len(unpaired_msa):
-			header = unpaired_msa[i]
-			seq = unpaired_msa[i+1]
-			if ('E+' in header or 'E-' in header) or '\t' not in header:
-				unpaired_dict[header] = seq
-			else:
-				paired_dict[header] = seq
+	for header, seq in iter_msa_records(json_chain['protein']['unpairedMsa']):
+		if ('E+' in header or 'E-' in header) or '\t' not in header:
+			unpaired_dict[header] = seq
+		else:
+			paired_dict[header] = seq
 
 	return num_copies, sequence, seqlen, unpaired_dict, paired_dict
 
 
 def build_paired_msa(paired_list, seqlens):
-	all_keys = sorted(list(set(key for d in paired_list for key in d.keys())))
+	# union of the keys of all chains, a dict keeps each key once without building a set
+	all_keys = list({key: None for d in paired_list for key in d})
+	all_keys.sort()
 
 	# loop through keys, and search them in each of the dict of paired_list. if you can find it, extract the sequence.
 	# if you cannot find it, pad it with the corresponding seqlens
+	pads = ['-' * seqlen for seqlen in seqlens]
 
 	paired_msa = []
-	for i, key in enumerate(all_keys):
-		# get the sequence from each of the paired_dicts
-		seqs = []
-		for j, d in enumerate(paired_list):
-			if key in d.keys():
-				seqs.append(d[key])
-			else:
-				# pad with gaps
-				seqs.append('-' * seqlens[j])
-
-		# add the sequence to the unpaired_list
+	for key in all_keys:
 		paired_msa.append(key)
-		paired_msa.append(''.join(seqs))
+		paired_msa.append(''.join([d.get(key, pad) for d, pad in zip(paired_list, pads)]))
 
 	return paired_msa
 
@@ -325,28 +436,30 @@ def build_paired_msa(paired_list, seqlens):
 def build_unpaired_msa(seqlens, unpaired_list):
 	unpaired_padded_msa = []
 
-	for i, chain_msa in enumerate(unpaired_list):
-		msa = chain_msa
-
-		# sum chains before i, calculate padding with this length
-		chain_len_before = sum(seqlens[:i])
-		chain_len_after = sum(seqlens[i+1:])
+	# prefix sums of the chain lengths, the length before chain i is prefix[i]
+	prefix = list(itertools.accumulate(seqlens, initial=0))
+	total = prefix[-1]
 
-		for header in msa.keys():
-			seq = msa[header]
-
-			# pad with gaps before and after
-			padded_seq = '-' * chain_len_before + seq + '-' * chain_len_after
+	for i, chain_msa in enumerate(unpaired_list):
+		# chains before and after i, the gaps are the same for every sequence of the chain
+		left_pad = '-' * prefix[i]
+		right_pad = '-' * (total - prefix[i+1])
 
+		for header, seq in chain_msa.items():
 			unpaired_padded_msa.append(header)
-			unpaired_padded_msa.append(padded_seq)
+			unpaired_padded_msa.append(left_pad + seq + right_pad)
 
 	return unpaired_padded_msa
 
 
 def process_json_file(input_file, output_dir='.', suffix=''):
-	with open(input_file, 'r') as f:
-		json_data = json.load(f)
+	# an empty file cannot be mapped
+	if os.path.getsize(input_file) == 0:
+		raise ValueError(f"JSON file {input_file} is empty")
+	
+	with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		with memoryview(mm) as view:
+			json_data = loads_json(view)
 	
 	basename = json_data['name']
 	
@@ -373,8 +486,8 @@ def process_json_file(input_file, output_dir='.', suffix=''):
 	
 	output_file = f"{basename}.a3m"
 	output_file = os.path.join(output_dir, os.path.basename(output_file))
-	with open(output_file, 'w') as f:
-		f.write('\n'.join(full_msa))
+	with open(output_file, 'w', buffering=1 << 20) as f:
+		f.writelines(line + '\n' for line in full_msa)
 	
 	print(f"Processed {input_file} -> {output_file}")
 
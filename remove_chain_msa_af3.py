@@ -2,8 +2,26 @@
 import argparse
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import List, Union
+from typing import List, Optional, Union
+
+try:
+    import orjson
+    
+    def dumps_json(data) -> bytes:
+        return orjson.dumps(data)
+    
+    def loads_json(raw: bytes):
+        return orjson.loads(raw)
+except ImportError:
+    def dumps_json(data) -> bytes:
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()
+    
+    def loads_json(raw: bytes):
+        return json.loads(raw)
+
 
 def modify_json_file(input_path: Path, output_path: Path, chains=2, remove_templates=True) -> None:
     """
@@ -15,8 +33,8 @@ def modify_json_file(input_path: Path, output_path: Path, chains=2, remove_templ
         output_path: Path where the modified JSON will be saved
     """
     try:
-        with open(input_path, 'r') as f:
-            data = json.load(f)
+        with open(input_path, 'rb') as f:
+            data = loads_json(f.read())
         
         # Modify the specific nested field
         try:
@@ -37,8 +55,8 @@ def modify_json_file(input_path: Path, output_path: Path, chains=2, remove_templ
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
         # Write modified data to output file
-        with open(output_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        with open(output_path, 'wb') as f:
+            f.write(dumps_json(data))
             
         print(f"Successfully processed: {input_path} -> {output_path}")
             
@@ -49,18 +67,36 @@ def modify_json_file(input_path: Path, output_path: Path, chains=2, remove_templ
         print(f"Error processing {input_path}")
         print(f"Error details: {str(e)}")
 
-def process_files(input_files: List[Path], output_dir: Path, chains=[2], remove_templates=True) -> None:
+def process_files(input_files: List[Path], output_dir: Path, chains=[2], remove_templates=True,
+                  max_workers: Optional[int] = None) -> None:
     """
     Process multiple JSON files and save modified versions to the output directory.
+    The files are independent, so they are processed in parallel worker processes.
     
     Args:
         input_files: List of paths to input JSON files
         output_dir: Directory where modified files will be saved
+        max_workers: Number of worker processes (default: number of CPUs)
     """
-    for input_path in input_files:
-        output_name = input_path.stem.replace('_data', '') + "_no_pep_msa.json"
-        output_path = output_dir / output_name
-        modify_json_file(input_path, output_path, chains, remove_templates)
+    output_paths = [output_dir / (input_path.stem.replace('_data', '') + "_no_pep_msa.json")
+                    for input_path in input_files]
+    
+    if len(input_files) == 1 or max_workers == 1:
+        for input_path, output_path in zip(input_files, output_paths):
+            modify_json_file(input_path, output_path, chains, remove_templates)
+        return
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(modify_json_file, input_files, output_paths, repeat(chains), repeat(remove_templates)))
+
+def positive_int(value: str) -> int:
+    """
+    Parse a command-line integer that must be at least 1.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 def main():
     parser = argparse.ArgumentParser(
@@ -83,6 +119,12 @@ def main():
         action='store_true',
         help='Also remove templates from selected chains, not just MSA.'
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=positive_int,
+        default=None,
+        help='Number of files processed in parallel (default: number of CPUs)'
+    )
     parser.add_argument(
         '-o', '--output-dir',
         type=Path,
@@ -111,7 +153,7 @@ def main():
         return
     
     chains = [int(x) for x in args.chains.split(',')]
-    process_files(valid_files, args.output_dir, chains, args.remove_templates)
+    process_files(valid_files, args.output_dir, chains, args.remove_templates, args.jobs)
 
 if __name__ == "__main__":
     main()
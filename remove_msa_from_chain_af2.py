@@ -1,10 +1,50 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import re
 import sys
+from bisect import bisect_left
+from itertools import accumulate
 from pathlib import Path
 
 
+INSERTIONS_RE = re.compile(rb'[a-z]+')
+
+
+def find_chain_ends(sequence, bounds):
+	"""
+	Find where each chain ends in an MSA row, lowercase insertions do not count toward the chain lengths.
+	Insertions after the last match column belong to the last chain.
+	
+	Args:
+		sequence (bytes): MSA row
+		bounds (list): Cumulative chain lengths
+	
+	Returns:
+		list: End position of each chain in the row
+	"""
+	# for each insertion: the number of match columns before it, and the number of inserted characters up to its end
+	insertion_starts = []
+	inserted_until = []
+	inserted = 0
+	for insertion in INSERTIONS_RE.finditer(sequence):
+		insertion_starts.append(insertion.start() - inserted)
+		inserted += insertion.end() - insertion.start()
+		inserted_until.append(inserted)
+	
+	ends = []
+	for bound in bounds:
+		# the insertions before the last match column of the chain shift its end
+		k = bisect_left(insertion_starts, bound)
+		ends.append(bound + inserted_until[k - 1] if k else bound)
+	
+	# insertions after the last match column belong to the last chain
+	if len(sequence) - inserted == bounds[-1]:
+		ends[-1] = len(sequence)
+	
+	return ends
+
+
 def main():
 	parser = argparse.ArgumentParser(
 		description="Remove a chain's MSA from an a3m file"
@@ -31,78 +71,85 @@ def main():
 	peptide = args.chain
 	outdir = args.output_dir
 	
+	# compare bytes, and dispatch on the first byte of the line instead of testing several prefixes
+	paired_prefix = b'>101\t102'
+	peptide_prefix = f'>10{peptide}'.encode()
+	
 	# open a file and iterate over its lines
-	new_lines = ''
+	new_lines = []
 	lengths = [1]
-	with open(input_msa) as f:
+	with open(input_msa, 'rb') as f:
 		lines_iter = iter(f)
 		skip = False
 		edit_msa = False
 		for line in lines_iter:
-			# print(skip, edit_msa, '\t' not in line, line)
-			if line.startswith('#'):
+			# print(skip, edit_msa, b'\t' not in line, line)
+			first = line[0]
+			if first == 0x23:  # '#'
 				# print('header')
 				# remove #, split on whitespace
 				lengths, _ = line[1:].split()
-				lengths = lengths.split(',')
+				lengths = lengths.split(b',')
+				lengths_int = [int(l) for l in lengths]
+				bounds = list(accumulate(lengths_int))
 				
 				if args.chain > len(lengths) or args.chain == 0:
 					print(f'Chain number {args.chain} is larger than the number of chains in the file or 0')
 					sys.exit(1)
 					
-				new_lines += line
-			elif '>101\t102' in line:
-				# print('first paired')
-				if len(lengths) > 2:  # we need to keep the rest, just pad the peptide
-					edit_msa = True
-				else:  # we can omit the paired msa
+				new_lines.append(line)
+			elif first == 0x3E:  # '>'
+				if line.startswith(paired_prefix):
+					# print('first paired')
+					if len(lengths) > 2:  # we need to keep the rest, just pad the peptide
+						edit_msa = True
+					else:  # we can omit the paired msa
+						skip = True
+					new_lines.append(line)
+					
+					# add also next line, safely using the iterator
+					try:
+						next_line = next(lines_iter)
+						new_lines.append(next_line)
+					except StopIteration:
+						# Handle case where there's no next line
+						pass
+				elif line.startswith(peptide_prefix):  # remove peptide entry
+					# print('peptide')
 					skip = True
-				new_lines += line
-				
-				# add also next line, safely using the iterator
-				try:
-					next_line = next(lines_iter)
-					new_lines += next_line
-				except StopIteration:
-					# Handle case where there's no next line
-					pass
-			elif line.startswith(f'>10{peptide}'):  # remove peptide entry
-				# print('peptide')
-				skip = True
-				new_lines += line
-				# add also next line, safely using the iterator
-				try:
-					next_line = next(lines_iter)
-					new_lines += next_line
-				except StopIteration:
-					# Handle case where there's no next line
-					pass
-			elif line.startswith('>') and '\t' not in line:  # keep MSA for the rest
-				# print('other chains')
-				skip = False
-				edit_msa = False
-				new_lines += line
-			elif edit_msa and not line.startswith('>'):
+					new_lines.append(line)
+					# add also next line, safely using the iterator
+					try:
+						next_line = next(lines_iter)
+						new_lines.append(next_line)
+					except StopIteration:
+						# Handle case where there's no next line
+						pass
+				elif b'\t' not in line:  # keep MSA for the rest
+					# print('other chains')
+					skip = False
+					edit_msa = False
+					new_lines.append(line)
+				elif not skip:
+					# print('keep')
+					new_lines.append(line)
+			elif edit_msa:
 				# print('edit msa')
-				line_to_add = ''
-				for i, l in enumerate(lengths):
+				seq = line.rstrip(b'\r\n')
+				ends = find_chain_ends(seq, bounds)
+				starts = [0] + ends[:-1]
+				
+				line_to_add = []
+				for i, (start, end) in enumerate(zip(starts, ends)):
 					if i != peptide - 1:
-						# loop through the line and add everything, until you didnt count l capital and - characters
-						# then remove the same amount of characters from the line
-						capital_dash = 0
-						for c in line:
-							line_to_add += c
-							if c.isupper() or c == '-':
-								capital_dash += 1
-							if capital_dash == int(l):
-								break
-						line = line[capital_dash:]
+						line_to_add.append(seq[start:end])
 					else:
-						line_to_add += '-' * int(l)
-				new_lines += f'{line_to_add}\n'
+						line_to_add.append(b'-' * lengths_int[i])
+				new_lines.append(b''.join(line_to_add))
+				new_lines.append(b'\n')
 			elif not skip:
 				# print('keep')
-				new_lines += line
+				new_lines.append(line)
 			else:
 				# print('skip')
 				pass
@@ -117,8 +164,8 @@ def main():
 	else:
 		outpath = str(input_msa).replace('.a3m', '_nomsa.a3m')
 	
-	with open(outpath, 'w') as f:
-		f.write(new_lines)
+	with open(outpath, 'wb') as f:
+		f.writelines(new_lines)
 	
 	print(f'New a3m file written to {outpath}')
 
@@ -3,9 +3,11 @@ logger = logging.getLogger(__name__)
 import os
 from pathlib import Path
 import argparse
-import glob
 import json
 import types, sys
+import re
+from bisect import bisect_left
+from itertools import accumulate
 
 # Otherwise on some CPU-s, the code crashes with not being able to import jax
 class MockModule(types.ModuleType):
@@ -19,29 +21,55 @@ sys.modules['jax.numpy'] = MockModule('jax.numpy')
 # This was the problem before the patch above
 from colabfold.batch import *
 
+try:
+	import _a3m_fast
+except ImportError:
+	_a3m_fast = None
 
-def split_input_by_chains(sequence, lengths):
-	result = []
-	current_pos = 0
+try:
+	import orjson
 	
-	for target_length in lengths:
-		chain_seq = ""
-		actual_length = 0
-		
-		# Keep adding characters until we reach the target length for this chain
-		while actual_length < target_length and current_pos < len(sequence):
-			char = sequence[current_pos]
-			chain_seq += char
-			
-			# Only count uppercase letters toward the actual length
-			if not char.islower():
-				actual_length += 1
-			
-			current_pos += 1
-		
-		result.append(chain_seq)
-		
-	return result
+	def dumps_json(data):
+		return orjson.dumps(data)
+	
+	def loads_json(raw):
+		return orjson.loads(raw)
+except ImportError:
+	def dumps_json(data):
+		return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()
+	
+	def loads_json(raw):
+		return json.loads(raw)
+
+
+INSERTIONS_RE = re.compile(r'[a-z]+')
+
+
+def split_input_by_chains(sequence, lengths):
+	bounds = list(accumulate(lengths))
+	
+	# for each insertion: the number of match columns before it, and the number of inserted characters up to its end
+	insertion_starts = []
+	inserted_until = []
+	inserted = 0
+	for insertion in INSERTIONS_RE.finditer(sequence):
+		insertion_starts.append(insertion.start() - inserted)
+		inserted += insertion.end() - insertion.start()
+		inserted_until.append(inserted)
+	
+	# the insertions before the last match column of a chain shift its end
+	ends = []
+	for bound in bounds:
+		k = bisect_left(insertion_starts, bound)
+		ends.append(bound + inserted_until[k - 1] if k else bound)
+	
+	# insertions after the last match column belong to the last chain
+	if len(sequence) - inserted == bounds[-1]:
+		ends[-1] = len(sequence)
+	
+	starts = [0] + ends[:-1]
+	
+	return [sequence[start:end] for start, end in zip(starts, ends)]
 
 
 def get_data_from_a3m(a3m_lines):
@@ -64,18 +92,27 @@ def get_data_from_a3m(a3m_lines):
 
 
 def split_msa_vertically(chains, dummy_chain_names, a3m_lines):
-	# create dictionary for each chain
-	dict_a3m_per_chain = {chain: [] for i, chain in enumerate(dummy_chain_names)}
+	# one buffer per chain, bind the append methods once instead of looking them up for every line
+	chain_buffers = [[] for _ in dummy_chain_names]
+	appenders = [buf.append for buf in chain_buffers]
+	
+	# use the compiled splitting if it was built
+	split_func = split_input_by_chains if _a3m_fast is None else _a3m_fast.split_by_chains
 	
 	for line in a3m_lines:
 		if line.startswith('>'):
-			[dict_a3m_per_chain[chain].append(line) for chain in dummy_chain_names]
+			# add the header line to all chains
+			for append in appenders:
+				append(line)
 		else:
 			# split the line into the corresponding chains
-			split_sequences = split_input_by_chains(line.strip(), chains)
+			split_sequences = split_func(line.strip(), chains)
 			
-			for i, chain in enumerate(dummy_chain_names):
-				dict_a3m_per_chain[chain].append(split_sequences[i])
+			for append, split_sequence in zip(appenders, split_sequences):
+				append(split_sequence)
+	
+	# create dictionary for each chain
+	dict_a3m_per_chain = dict(zip(dummy_chain_names, chain_buffers))
 	
 	return dict_a3m_per_chain
 
@@ -99,18 +136,37 @@ def create_a3m_mmseqs(sequences, jobname, use_templates):
 	return msa
 
 
+def find_template_paths(root='.'):
+	# map each templates_* directory one level below root to its path, keep the first one found
+	template_paths = {}
+	with os.scandir(root) as entries:
+		for entry in entries:
+			if entry.name.startswith('.') or not entry.is_dir():
+				continue
+			# skip directories that cannot be read, as glob does
+			try:
+				with os.scandir(entry.path) as sub_entries:
+					for sub_entry in sub_entries:
+						if sub_entry.name.startswith('templates_') and sub_entry.is_dir():
+							template_paths.setdefault(sub_entry.name, os.path.join(entry.name, sub_entry.name))
+			except OSError:
+				continue
+	
+	return template_paths
+
+
 def add_to_json(json_data, dict_a3m_per_chain):
-	template_paths = glob.glob(f"*/templates_*/")
+	template_paths = find_template_paths()
 	
 	i = 101
 	for l, chain in enumerate(json_data['sequences']):
-		matching_paths = [path for path in template_paths if f'templates_{i}' in path]
-		if matching_paths:  # Check if any paths matched
-			json_data['sequences'][l]['protein']['templates'] = f"{os.getcwd()}/{matching_paths[0]}"
+		template_path = template_paths.get(f'templates_{i}')
+		if template_path:
+			json_data['sequences'][l]['protein']['templates'] = f"{os.getcwd()}/{template_path}/"
 		else:
 			json_data['sequences'][l]['protein']['templates'] = ''
 		
-		if 'protein' in chain.keys():
+		if 'protein' in chain:
 			json_data['sequences'][l]['protein']['unpairedMsa'] = '\n'.join(dict_a3m_per_chain[str(i)])
 			i += 1
 		
@@ -143,12 +199,12 @@ if __name__ == "__main__":
 	os.rename(args.input, json_file)
 	
 	# load the JSON file
-	with open(json_file, 'r') as f:
-		data = json.load(f)
+	with open(json_file, 'rb') as f:
+		data = loads_json(f.read())
 	
 	# get info from json
 	jobname = data['name']
-	sequences = [x['protein']['sequence'] for x in data['sequences'] if 'protein' in x.keys()]
+	sequences = [x['protein']['sequence'] for x in data['sequences'] if 'protein' in x]
 	
 	a3m_lines = create_a3m_mmseqs(sequences, jobname, args.use_templates)
 	
@@ -164,5 +220,5 @@ if __name__ == "__main__":
 	
 	# write out the json, in place of the original
 	json_file = args.input.replace('.json', '_paired.json')
-	with open(args.input, 'w') as f:
-		json.dump(json_data, f, indent=4)
+	with open(args.input, 'wb') as f:
+		f.write(dumps_json(json_data))